@@ -0,0 +1,23 @@
+import os
+
+# The kernels are only compiled with numba when BIGGR_MAPS_JIT is set, for
+# typical maps importing numba and compiling costs more than it saves.
+USE_JIT = False
+if os.environ.get("BIGGR_MAPS_JIT", "").lower() in ("1", "true", "yes"):
+    try:
+        from numba import njit
+
+        USE_JIT = True
+    except ImportError:
+        pass
+
+if not USE_JIT:
+    # Without numba the kernels run as plain Python.
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(f):
+            return f
+
+        return decorator
@@ -1,38 +1,210 @@
 import math
+from collections import deque
+from typing import Dict, List, Optional, Tuple
 from biggr_maps import map, pathway
-from itertools import islice, pairwise
+from biggr_maps._jit import USE_JIT, njit
+from itertools import pairwise
 import xml.etree.ElementTree as ET
 from functools import partial
+import numpy as np
 
 
-# Not available in python 3.10 yet, should be removed and
-# itertools.batched should be used.
-def batched(iterable, n, *, strict=False):
-    # batched('ABCDEFG', 2) → AB CD EF G
-    if n < 1:
-        raise ValueError("n must be at least one")
-    iterator = iter(iterable)
-    while batch := tuple(islice(iterator, n)):
-        if strict and len(batch) != n:
-            raise ValueError("batched(): incomplete batch")
-        yield batch
+# A point lies within a segment when the segment is axis-aligned and the point
+# is inside its bounding box.
+@njit(cache=True, inline="always")
+def _within_kernel(x, y, x1, y1, x2, y2):
+    # The sign of the products tells whether the point lies between both ends.
+    if x1 != x2 and y1 != y2:
+        return False
+    return (x - x1) * (x - x2) <= 0 and (y - y1) * (y - y2) <= 0
 
-def is_within(coord, refcoord1, refcoord2):
-    min_x = refcoord1[0] if refcoord1[0] < refcoord2[0] else refcoord2[0]
-    min_y = refcoord1[1] if refcoord1[1] < refcoord2[1] else refcoord2[1]
-    max_x = refcoord1[0] if refcoord1[0] >= refcoord2[0] else refcoord2[0]
-    max_y = refcoord1[1] if refcoord1[1] >= refcoord2[1] else refcoord2[1]
 
-    if min_x == max_x:
-        return (coord[0] == min_x) and (min_y <= coord[1] <= max_y)
-    elif min_y == max_y:
-        return (coord[1] == min_y) and (min_x <= coord[1] <= max_x)
-    return False
+@njit(cache=True)
+def _overlapping_segments_kernel(a, b):
+    out = np.empty((max(a.shape[0] - 1, 0) * max(b.shape[0] - 1, 0), 2, 2))
+    k = 0
+    for i in range(a.shape[0] - 1):
+        a1_x, a1_y, a2_x, a2_y = a[i, 0], a[i, 1], a[i + 1, 0], a[i + 1, 1]
+        for j in range(b.shape[0] - 1):
+            b1_x, b1_y, b2_x, b2_y = b[j, 0], b[j, 1], b[j + 1, 0], b[j + 1, 1]
+            if _within_kernel(a1_x, a1_y, b1_x, b1_y, b2_x, b2_y):
+                start_x, start_y = a1_x, a1_y
+                if _within_kernel(a2_x, a2_y, b1_x, b1_y, b2_x, b2_y):
+                    end_x, end_y = a2_x, a2_y
+                elif _within_kernel(b1_x, b1_y, a1_x, a1_y, a2_x, a2_y):
+                    end_x, end_y = b1_x, b1_y
+                elif _within_kernel(b2_x, b2_y, a1_x, a1_y, a2_x, a2_y):
+                    end_x, end_y = b2_x, b2_y
+                else:
+                    continue
+            elif _within_kernel(a2_x, a2_y, b1_x, b1_y, b2_x, b2_y):
+                start_x, start_y = a2_x, a2_y
+                if _within_kernel(b1_x, b1_y, a1_x, a1_y, a2_x, a2_y):
+                    end_x, end_y = b1_x, b1_y
+                elif _within_kernel(b2_x, b2_y, a1_x, a1_y, a2_x, a2_y):
+                    end_x, end_y = b2_x, b2_y
+                else:
+                    continue
+            else:
+                continue
+            out[k, 0, 0] = start_x
+            out[k, 0, 1] = start_y
+            out[k, 1, 0] = end_x
+            out[k, 1, 1] = end_y
+            k += 1
+    return out, k
+
+
+def _overlapping_segments_loop(line: list, overlapping_line: list) -> list:
+    # Same as _overlapping_segments_kernel, written for tuples in plain Python.
+    out = []
+    for (a1_x, a1_y), (a2_x, a2_y) in pairwise(line):
+        for (b1_x, b1_y), (b2_x, b2_y) in pairwise(overlapping_line):
+            if _within_kernel(a1_x, a1_y, b1_x, b1_y, b2_x, b2_y):
+                start = (a1_x, a1_y)
+                if _within_kernel(a2_x, a2_y, b1_x, b1_y, b2_x, b2_y):
+                    end = (a2_x, a2_y)
+                elif _within_kernel(b1_x, b1_y, a1_x, a1_y, a2_x, a2_y):
+                    end = (b1_x, b1_y)
+                elif _within_kernel(b2_x, b2_y, a1_x, a1_y, a2_x, a2_y):
+                    end = (b2_x, b2_y)
+                else:
+                    continue
+            elif _within_kernel(a2_x, a2_y, b1_x, b1_y, b2_x, b2_y):
+                start = (a2_x, a2_y)
+                if _within_kernel(b1_x, b1_y, a1_x, a1_y, a2_x, a2_y):
+                    end = (b1_x, b1_y)
+                elif _within_kernel(b2_x, b2_y, a1_x, a1_y, a2_x, a2_y):
+                    end = (b2_x, b2_y)
+                else:
+                    continue
+            else:
+                continue
+            out.append((start, end))
+    return out
+
+
+def overlapping_segments(line, overlapping_line):
+    if USE_JIT:
+        a = np.ascontiguousarray(line, dtype=np.float64)
+        b = np.ascontiguousarray(overlapping_line, dtype=np.float64)
+        out, k = _overlapping_segments_kernel(a, b)
+        return out[:k]
+
+    # Without numba, looping over plain tuples is the fastest for the short
+    # lines found in KGML files.
+    if isinstance(line, np.ndarray):
+        line = line.tolist()
+    if isinstance(overlapping_line, np.ndarray):
+        overlapping_line = overlapping_line.tolist()
+    return _overlapping_segments_loop(line, overlapping_line)
+
+
+def _collinear(coord1, coord2, coord3) -> bool:
+    return (coord1[0] == coord2[0] == coord3[0]) or (coord1[1] == coord2[1] == coord3[1])
+
+
+def merge_segments(segments) -> List[List[Tuple[float, float]]]:
+    chains = []
+    # Chain indices by end coordinate. A segment extends the first chain that
+    # ends at one of its coordinates, trying the head before the tail.
+    chains_by_end: Dict[Tuple[float, float], List[int]] = {}
+    for coord1, coord2 in segments:
+        coord1 = (float(coord1[0]), float(coord1[1]))
+        coord2 = (float(coord2[0]), float(coord2[1]))
+        if coord1 == coord2:
+            continue
+        candidates = chains_by_end.get(coord1, []) + chains_by_end.get(coord2, [])
+        if not candidates:
+            chains_by_end.setdefault(coord1, []).append(len(chains))
+            chains_by_end.setdefault(coord2, []).append(len(chains))
+            chains.append(deque((coord1, coord2)))
+            continue
+        index = min(candidates)
+        chain = chains[index]
+        if chain[0] == coord1 or chain[0] == coord2:
+            old_coord = chain[0]
+            new_coord = coord2 if old_coord == coord1 else coord1
+            if new_coord == chain[1]:
+                # A segment that backtracks over the last step shortens the
+                # chain, unless that step is all that is left.
+                if len(chain) > 2:
+                    chain.popleft()
+            else:
+                if _collinear(chain[0], chain[1], new_coord):
+                    chain.popleft()
+                chain.appendleft(new_coord)
+            new_end = chain[0]
+        else:
+            old_coord = chain[-1]
+            new_coord = coord2 if old_coord == coord1 else coord1
+            if new_coord == chain[-2]:
+                if len(chain) > 2:
+                    chain.pop()
+            else:
+                if _collinear(chain[-1], chain[-2], new_coord):
+                    chain.pop()
+                chain.append(new_coord)
+            new_end = chain[-1]
+        if new_end != old_coord:
+            chains_by_end[old_coord].remove(index)
+            chains_by_end.setdefault(new_end, []).append(index)
+    return [list(chain) for chain in chains]
+
+
+def _compound_node(entry: ET.Element, scale_factor: float) -> Optional[map.MetaboliteNode]:
+    node_name = entry.attrib["name"].removeprefix("cpd:")
+    graphic = None
+    for entry_child in entry.iterfind("graphics"):
+        if entry_child.attrib.get("type") != "circle":
+            continue
+        graphic = entry_child
+        break
+    if graphic is None:
+        return None
+    graphic_attrib = graphic.attrib
+    x = float(graphic_attrib["x"]) * scale_factor
+    y = float(graphic_attrib["y"]) * scale_factor
+    return map.MetaboliteNode(
+        bigg_id=node_name, name=node_name, x=x, y=y, node_is_primary=True
+    )
+
+
+def _reaction_lines(entry: ET.Element, scale_factor: float) -> list:
+    lines = []
+    for entry_child in entry.iterfind("graphics"):
+        attrib = entry_child.attrib
+        if attrib.get("type") != "line":
+            continue
+        coords = np.fromstring(attrib["coords"], dtype=np.float64, sep=",")
+        lines.append(coords.reshape(-1, 2) * scale_factor)
+    return lines
+
+
+def _compute_mid_and_angle(lines: list, flip: bool) -> Optional[Tuple[float, float, float]]:
+    overlapping_line = lines[0]
+    for line in lines[1:]:
+        ol = merge_segments(overlapping_segments(line, overlapping_line))
+        if not ol:
+            return None
+        overlapping_line = ol[0]
+    overlapping_arr = np.asarray(overlapping_line, dtype=np.float64)
+    deltas = np.diff(overlapping_arr, axis=0)
+    index_max = int((deltas**2).sum(axis=1).argmax())
+    dx, dy = (float(v) for v in deltas[index_max])
+    mid_x = float(overlapping_arr[index_max, 0]) + dx/2
+    mid_y = float(overlapping_arr[index_max, 1]) + dy/2
+    angle = math.atan2(dy, dx)
+    if flip:
+        angle = math.remainder(angle + math.pi, 2 * math.pi)
+    return mid_x, mid_y, angle
 
 
 def kgml_to_escher_map(filename: str, scale_factor: float=3.0) -> map.Map:
-    tree = ET.parse(filename)
-    root = tree.getroot()
+    # Stream the KGML file, top-level elements are reduced to the data that
+    # is needed and cleared afterwards to keep the memory footprint small.
+    context = ET.iterparse(filename, events=("start", "end"))
+    _, root = next(context)
 
     name = root.attrib["title"]
     m = map.Map(name, description=name)
@@ -40,144 +212,67 @@ def kgml_to_escher_map(filename: str, scale_factor: float=3.0) -> map.Map:
     nodes = {}
     reactions = {}
     reaction_synonyms = {}
-
-    for child in root:
-        if child.tag != "entry":
-            continue
-        if child.attrib.get("type") != "compound":
-            continue
-        child_id = int(child.attrib["id"])
-        node_name = child.attrib["name"].removeprefix("cpd:")
-        graphic = None
-        for entry_child in child:
-            if entry_child.tag != "graphics":
-                continue
-            if entry_child.attrib.get("type") != "circle":
-                continue
-            graphic = entry_child
-            break
-        if graphic is None:
-            continue
-        x = float(graphic.attrib["x"]) * scale_factor
-        y = float(graphic.attrib["y"]) * scale_factor
-        metabolite_node = map.MetaboliteNode(
-            bigg_id=node_name, name=node_name, x=x, y=y, node_is_primary=True
-        )
-        nodes[child_id] = metabolite_node
-
     reaction_lines = {}
-    for child in root:
-        if child.tag != "entry":
+    reaction_elements = []
+    mid_markers = []
+
+    for event, child in context:
+        if event != "end":
             continue
-        if child.attrib.get("type") not in ["gene", "ortholog", "reaction"]:
+        tag = child.tag
+        attrib = child.attrib
+        if tag == "entry":
+            entry_type = attrib.get("type")
+            if entry_type == "compound":
+                metabolite_node = _compound_node(child, scale_factor)
+                if metabolite_node is not None:
+                    nodes[int(attrib["id"])] = metabolite_node
+            elif entry_type in ("gene", "ortholog", "reaction"):
+                reaction_names = [
+                    x.removeprefix("rn:") for x in attrib["reaction"].split(" ")
+                ]
+                reaction_name = reaction_names[0]
+                reaction_synonyms.update(dict.fromkeys(reaction_names, reaction_name))
+                reaction_lines[reaction_name] = _reaction_lines(child, scale_factor)
+        elif tag == "reaction":
+            participants = []
+            for entry_child in child:
+                child_tag = entry_child.tag
+                if child_tag == "substrate":
+                    coefficient = -1
+                elif child_tag == "product":
+                    coefficient = 1
+                else:
+                    continue
+                participants.append((coefficient, int(entry_child.attrib["id"])))
+            reaction_elements.append((attrib["name"], participants))
+        elif tag != "relation":
             continue
-        reaction_names = [
-            x.removeprefix("rn:") for x in child.attrib["reaction"].split(" ")
-        ]
-        reaction_name = reaction_names[0]
-        for rn in reaction_names:
-            reaction_synonyms[rn] = reaction_name
-        lines = []
-        for entry_child in child:
-            if entry_child.tag != "graphics":
-                continue
-            if entry_child.attrib.get("type") != "line":
-                continue
-            coords = entry_child.attrib["coords"]
-            coords = list(batched((float(x) * scale_factor for x in coords.split(",")), 2))
-            lines.append(coords)
-        reaction_lines[reaction_name] = lines
+        child.clear()
 
-    for child in root:
-        if child.tag != "reaction":
-            continue
-        reaction_id = int(child.attrib["id"])
-        reaction_name = (
-            child.attrib["name"].split(" ", maxsplit=1)[0].removeprefix("rn:")
-        )
+    for reaction_name, participants in reaction_elements:
+        reaction_name = reaction_name.split(" ", maxsplit=1)[0].removeprefix("rn:")
         reaction_name = reaction_synonyms[reaction_name]
         if reactions.get(reaction_name) is not None:
             continue
-        metabolites = []
-        for entry_child in child:
-            if entry_child.tag == "substrate":
-                coefficient = -1
-            elif entry_child.tag == "product":
-                coefficient = 1
-            else:
-                continue
-            node = nodes[int(entry_child.attrib["id"])]
-            metabolites.append({"coefficient": coefficient, "node": node})
+        metabolites = [
+            (coefficient, nodes[node_id]) for coefficient, node_id in participants
+        ]
 
         lines = reaction_lines[reaction_name]
         if lines:
-            overlapping_line = lines[0]
             flip = False
-            for metabolite_info in metabolites:
-                node = metabolite_info["node"]
-                if ((node.x - overlapping_line[0][0])**2 + (node.y - overlapping_line[0][1])**2) <= (25 * scale_factor)**2:
-                    flip = metabolite_info["coefficient"] > 0
+            for coefficient, node in metabolites:
+                if ((node.x - lines[0][0][0])**2 + (node.y - lines[0][0][1])**2) <= (25 * scale_factor)**2:
+                    flip = coefficient > 0
                     print("Found flip")
                     break
-            for line in lines[1:]:
-                overlapping_segments = []
-                for coord0_1, coord0_2 in pairwise(line):
-                    for coord1_1, coord1_2 in pairwise(overlapping_line):
-                        if is_within(coord0_1, coord1_1, coord1_2):
-                            if is_within(coord0_2, coord1_1, coord1_2):
-                                overlapping_segments.append((coord0_1, coord0_2))
-                            elif is_within(coord1_1, coord0_1, coord0_2):
-                                overlapping_segments.append((coord0_1, coord1_1))
-                            elif is_within(coord1_2, coord0_1, coord0_2):
-                                overlapping_segments.append((coord0_1, coord1_2))
-                        elif is_within(coord0_2, coord1_1, coord1_2):
-                            if is_within(coord1_1, coord0_1, coord0_2):
-                                overlapping_segments.apend((coord0_2, coord1_1))
-                            elif is_within(coord1_2, coord0_1, coord0_2):
-                                overlapping_segments.apend((coord0_2, coord1_2))
-                ol = []
-                for segment in overlapping_segments:
-                    for o in ol:
-                        if o[0][0] == segment[0][0] and o[0][1] == segment[0][1]:
-                            if (o[0][0] == o[1][0] == segment[1][0]) or (o[0][1] == o[1][1] == segment[1][1]):
-                                o.pop(0)
-                            o.insert(0, segment[1])
-                            break
-                        elif o[0][0] == segment[1][0] and o[0][1] == segment[1][1]:
-                            if (o[0][0] == o[1][0] == segment[0][0]) or (o[0][1] == o[1][1] == segment[0][1]):
-                                o.pop(0)
-                            o.insert(0, segment[0])
-                            break
-                        elif o[1][0] == segment[0][0] and o[1][1] == segment[0][1]:
-                            if (o[0][0] == o[1][0] == segment[1][0]) or (o[0][1] == o[1][1] == segment[1][1]):
-                                o.pop(-1)
-                            o.append(segment[1])
-                            break
-                        elif o[1][0] == segment[1][0] and o[1][1] == segment[1][1]:
-                            if (o[0][0] == o[1][0] == segment[0][0]) or (o[0][1] == o[1][1] == segment[0][1]):
-                                o.pop(-1)
-                            o.append(segment[0])
-                            break
-                    else:
-                        ol.append([segment[0], segment[1]])
-                if not ol:
-                    print(f"No overlapping line found for reaction {reaction_name}")
-                    overlapping_line = lines[0]
-                    break
-                else:
-                    overlapping_line = ol[0]
-            lengths = [
-                ((coord2[0] - coord1[0]) ** 2 + (coord2[1] - coord1[1]))
-                for coord1, coord2 in pairwise(overlapping_line)
-            ]
-            index_max = max(range(len(lengths)), key=lengths.__getitem__)
-            dx = (overlapping_line[index_max + 1][0] - overlapping_line[index_max][0])
-            dy = (overlapping_line[index_max + 1][1] - overlapping_line[index_max][1])
-            mid_x = overlapping_line[index_max][0] + dx/2
-            mid_y = overlapping_line[index_max][1] + dy/2     
-            angle = math.atan2(dy, dx)
-            if flip:
-                angle = math.remainder(angle + math.pi, 2 * math.pi)
+            placement = _compute_mid_and_angle(lines, flip)
+            if placement is None:
+                print(f"No overlapping line found for reaction {reaction_name}")
+                # A single line always yields a placement.
+                placement = _compute_mid_and_angle(lines[:1], flip)
+            mid_x, mid_y, angle = placement
             mid_marker = map.MidMarkerNode(mid_x, mid_y)
             
             reaction = map.AutoReactionWithOptionalMetabolites(
@@ -187,20 +282,21 @@ def kgml_to_escher_map(filename: str, scale_factor: float=3.0) -> map.Map:
                 angle=angle,
                 unit=50,
             )
-            for metabolite_info in metabolites:
-                reaction.add_metabolite(**metabolite_info)
+            for coefficient, node in metabolites:
+                reaction.add_metabolite(node=node, coefficient=coefficient)
             reactions[reaction_name] = reaction
+            mid_markers.append(reaction.mid_marker)
         else:
-            for metabolite_info in metabolites:
-                m.add_node(metabolite_info["node"])
-            mid_markers = [r.mid_marker for r in reactions.values()]
+            for _, node in metabolites:
+                m.add_node(node)
             reaction = pathway.place_reaction_on_backbone(
                 map=m,
                 name=reaction_name,
                 bigg_id=reaction_name,
-                reaction_info=[(x["coefficient"], x["node"]) for x in metabolites],
+                reaction_info=metabolites,
                 additional_mid_markers=mid_markers,
                 placement_f=partial(pathway.alternating_pathways_sides, spacing=100)
             )
             reactions[reaction_name] = reaction
+            mid_markers.append(reaction.mid_marker)
     return m, reactions, nodes
\ No newline at end of file
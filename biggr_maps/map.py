@@ -1,9 +1,32 @@
+from bisect import bisect_left, insort
 from dataclasses import dataclass
-import math
-from typing import Any, Dict, List, Optional, Tuple, Union
+from functools import lru_cache
+from itertools import chain
+from math import atan2, cos, pi, remainder, sin, sqrt
+from typing import Any, BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import orjson
+
+from biggr_maps._jit import njit
+
+_TWO_PI = 2.0 * pi
 
 
 class Map:
+    __slots__ = (
+        "name",
+        "description",
+        "homepage",
+        "schema",
+        "reactions",
+        "nodes",
+        "segments",
+        "labels",
+        "canvas",
+        "_mid_markers",
+    )
+
     def __init__(
         self,
         name: str,
@@ -22,96 +45,138 @@ class Map:
         self.description = description
         self.homepage = homepage
         self.schema = schema
-        self.reactions = {}
-        self.nodes = {}
-        self.segments = {}
-        self.labels = {}
+        self.reactions = []
+        self.nodes = []
+        self.segments = []
+        self.labels = []
         self.canvas = canvas
-        self._node_counter = 0
-        self._reaction_counter = 0
-        self._segment_counter = 0
-        self._label_counter = 0
+        self._mid_markers = []
 
+    # Identifiers are the (string) index of the element in its list, they are
+    # only handed out by the add_* methods below.
     def add_node(self, node: Optional["Node"]):
-        if node is None or node.identifier is not None:
-            return
-        while str(self._node_counter) in self.nodes:
-            self._node_counter += 1
-        node.identifier = str(self._node_counter)
-        self.nodes[node.identifier] = node
-        self._node_counter += 1
-    
+        self._bulk_add_nodes((node,))
+
+    def _bulk_add_nodes(self, nodes: Iterable[Optional["Node"]]):
+        map_nodes = self.nodes
+        mid_markers = self._mid_markers
+        for node in nodes:
+            if node is None or node.identifier is not None:
+                continue
+            node.identifier = str(len(map_nodes))
+            map_nodes.append(node)
+            if node.node_type == "midmarker":
+                mid_markers.append(node)
+
+    def has_node(self, node: "Node") -> bool:
+        if node.identifier is None:
+            return False
+        index = int(node.identifier)
+        return index < len(self.nodes) and self.nodes[index] is node
+
+    @property
+    def mid_markers(self) -> List["MidMarkerNode"]:
+        return self._mid_markers
+
     def add_segment(self, segment: "Segment"):
-        while str(self._segment_counter) in self.segments:
-            self._segment_counter += 1
-        segment.identifier = str(self._segment_counter)
-        self.segments[segment.identifier] = segment
-        self._segment_counter += 1
+        segment.identifier = str(len(self.segments))
+        self.segments.append(segment)
+
+    def _bulk_add_segments(self, segments: List["Segment"]):
+        map_segments = self.segments
+        for i, segment in enumerate(segments, len(map_segments)):
+            segment.identifier = str(i)
+        map_segments.extend(segments)
 
     def add_reaction(self, reaction: "Reaction"):
-        while str(self._reaction_counter) in self.reactions:
-            self._reaction_counter += 1
-        reaction.identifier = str(self._reaction_counter)
+        reaction.identifier = str(len(self.reactions))
         reaction._map = self
-        self.reactions[reaction.identifier] = reaction
-        self._reaction_counter += 1
+        self.reactions.append(reaction)
 
-        for _, node in reaction.metabolites:
-            self.add_node(node)
-        self.add_node(reaction.mid_marker)
-        self.add_node(reaction.multi_markers[0])
-        self.add_node(reaction.multi_markers[1])
+        self._bulk_add_nodes(
+            chain(
+                (node for _, node in reaction.metabolites),
+                (reaction.mid_marker, reaction._mm_minus, reaction._mm_plus),
+            )
+        )
 
-        for segment in reaction.segments:
-            self.add_segment(segment)
+        self._bulk_add_segments(reaction.segments)
 
     def add_label(self, label: "TextLabel"):
-        while str(self._label_counter) in self.labels:
-            self._label_counter += 1
-        label.identifier = str(self._label_counter)
-        self.labels[label.identifier] = label
-        self._label_counter += 1
+        label.identifier = str(len(self.labels))
+        self.labels.append(label)
 
     def fit_canvas(self, spacing: float = 100, expand_only=False):
         if expand_only:
-            min_x = self.canvas[0]
-            min_y = self.canvas[1]
-            max_x = self.canvas[0] + self.canvas[2]
-            max_y = self.canvas[1] + self.canvas[3]
+            lower = np.array([self.canvas[0], self.canvas[1]], dtype=np.float64)
+            upper = lower + np.array([self.canvas[2], self.canvas[3]], dtype=np.float64)
         else:
-            min_x, max_x, min_y, max_y = 0, 0, 0, 0
-        for node in self.nodes.values():
-            min_x = min(min_x, node.x)
-            max_x = max(max_x, node.x)
-            min_y = min(min_y, node.y)
-            max_y = max(max_y, node.y)
-        min_x -= spacing
-        min_y -= spacing
-        max_x += spacing
-        max_y += spacing
+            lower = np.zeros(2, dtype=np.float64)
+            upper = np.zeros(2, dtype=np.float64)
+        if self.nodes:
+            coords = np.fromiter(
+                chain.from_iterable((node.x, node.y) for node in self.nodes),
+                dtype=np.float64,
+                count=len(self.nodes) * 2,
+            ).reshape(-1, 2)
+            lower = np.minimum(lower, coords.min(axis=0))
+            upper = np.maximum(upper, coords.max(axis=0))
+        min_x, min_y = (float(v) - spacing for v in lower)
+        max_x, max_y = (float(v) + spacing for v in upper)
         self.canvas = (min_x, min_y, max_x - min_x, max_y - min_y)
 
-    def to_escher(self):
-        d_header = {
+    def _escher_header(self):
+        return {
             "map_name": self.name,
             "map_description": self.description,
             "homepage": self.homepage,
             "schema": self.schema,
         }
+
+    def _escher_canvas(self):
+        return {
+            "x": self.canvas[0],
+            "y": self.canvas[1],
+            "width": self.canvas[2],
+            "height": self.canvas[3],
+        }
+
+    def to_escher(self):
         d_body = {
-            "reactions": {k: v.to_escher() for k, v in self.reactions.items()},
-            "nodes": {k: v.to_escher() for k, v in self.nodes.items()},
-            "text_labels": {k: v.to_escher() for k, v in self.labels.items()},
-            "canvas": {
-                "x": self.canvas[0],
-                "y": self.canvas[1],
-                "width": self.canvas[2],
-                "height": self.canvas[3],
-            },
+            "reactions": {str(i): v.to_escher() for i, v in enumerate(self.reactions)},
+            "nodes": {str(i): v.to_escher() for i, v in enumerate(self.nodes)},
+            "text_labels": {str(i): v.to_escher() for i, v in enumerate(self.labels)},
+            "canvas": self._escher_canvas(),
         }
-        return [d_header, d_body]
+        return [self._escher_header(), d_body]
+
+    def to_json_bytes(self) -> bytes:
+        return orjson.dumps(self.to_escher(), option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def dump(self, fp: BinaryIO):
+        # Writes the same document as to_escher, but encodes one element at a
+        # time instead of building the full nested dict first.
+        option = orjson.OPT_SERIALIZE_NUMPY
+        fp.write(b"[")
+        fp.write(orjson.dumps(self._escher_header(), option=option))
+        for key, elements in (
+            (b',{"reactions":{', self.reactions),
+            (b'},"nodes":{', self.nodes),
+            (b'},"text_labels":{', self.labels),
+        ):
+            fp.write(key)
+            for i, element in enumerate(elements):
+                if i:
+                    fp.write(b",")
+                fp.write(b'"%d":' % i)
+                fp.write(orjson.dumps(element.to_escher(), option=option))
+        fp.write(b'},"canvas":')
+        fp.write(orjson.dumps(self._escher_canvas(), option=option))
+        fp.write(b"}]")
 
 class TextLabel:
+    __slots__ = ("identifier", "x", "y", "text")
+
     def __init__(self, x: float, y: float, text: str):
         self.identifier = None
         self.x = x
@@ -119,11 +184,11 @@ class TextLabel:
         self.text = text
     
     def to_escher(self):
-        d = self.__dict__.copy()
-        del d["identifier"]
-        return d
+        return {"x": self.x, "y": self.y, "text": self.text}
 
 class Node:
+    __slots__ = ("identifier", "node_type", "x", "y")
+
     def __init__(self, x: Optional[float] = None, y: Optional[float] = None):
         self.identifier = None
         self.node_type = None
@@ -131,16 +196,18 @@ class Node:
         self.y = y
 
     def to_escher(self):
-        d = self.__dict__.copy()
-        del d["identifier"]
-        return d
+        return {"node_type": self.node_type, "x": self.x, "y": self.y}
 
     def copy(self):
-        o = self.__class__(**{k: v for k, v in self.__dict__.items() if k not in ["node_type", "identifier"]})
+        d = self.to_escher()
+        del d["node_type"]
+        o = self.__class__(**d)
         o.node_type = self.node_type
         return o
     
 class MetaboliteNode(Node):
+    __slots__ = ("bigg_id", "name", "label_x", "label_y", "node_is_primary")
+
     def __init__(
         self,
         bigg_id: str,
@@ -159,20 +226,38 @@ class MetaboliteNode(Node):
         self.label_y = label_y
         self.node_is_primary = node_is_primary
 
+    def to_escher(self):
+        return {
+            "node_type": self.node_type,
+            "x": self.x,
+            "y": self.y,
+            "bigg_id": self.bigg_id,
+            "name": self.name,
+            "label_x": self.label_x,
+            "label_y": self.label_y,
+            "node_is_primary": self.node_is_primary,
+        }
+
 
 class MultiMarkerNode(Node):
+    __slots__ = ()
+
     def __init__(self, x: float, y: float):
         super().__init__(x, y)
         self.node_type = "multimarker"
 
 
 class MidMarkerNode(Node):
+    __slots__ = ()
+
     def __init__(self, x: float, y: float):
         super().__init__(x, y)
         self.node_type = "midmarker"
 
 
 class Segment:
+    __slots__ = ("identifier", "from_node", "to_node", "b1", "b2")
+
     def __init__(
         self,
         from_node: Node,
@@ -208,6 +293,23 @@ def node_from_dict(d: Dict[str, Any]) -> Node:
     )
 
 class Reaction:
+    __slots__ = (
+        "identifier",
+        "_map",
+        "name",
+        "bigg_id",
+        "label_x",
+        "label_y",
+        "reversibility",
+        "mid_marker",
+        "_mm_minus",
+        "_mm_plus",
+        "metabolites",
+        "segments",
+        "gene_reaction_rule",
+        "genes",
+    )
+
     def __init__(
         self,
         name: str,
@@ -229,34 +331,42 @@ class Reaction:
         self.label_y = label_y
         self.reversibility = reversibility
         self.mid_marker = mid_marker
-        self.multi_markers = (minus_multi_marker, plus_multi_marker)
+        self._mm_minus = minus_multi_marker
+        self._mm_plus = plus_multi_marker
         self.metabolites = []
         self.segments = []
         self.gene_reaction_rule = gene_reaction_rule
         self.genes = genes
         self._add_multi_marker_segments()
 
+    @property
+    def multi_markers(self):
+        return (self._mm_minus, self._mm_plus)
+
     def add_segment(self, segment: "Segment"):
         if self._map is not None:
             self._map.add_segment(segment)
         self.segments.append(segment)
     
     def _add_multi_marker_segments(self):
-        if self.multi_markers[0] is not None:
-            self.add_segment(Segment(self.multi_markers[0], self.mid_marker))
-        if self.multi_markers[1] is not None:
-            self.add_segment(Segment(self.mid_marker, self.multi_markers[1]))
+        if self._mm_minus is not None:
+            self.add_segment(Segment(self._mm_minus, self.mid_marker))
+        if self._mm_plus is not None:
+            self.add_segment(Segment(self.mid_marker, self._mm_plus))
+
+    def _ref_node(self, plus_minus: bool) -> Node:
+        multi_marker = self._mm_plus if plus_minus else self._mm_minus
+        if multi_marker is not None:
+            return multi_marker
+        return self.mid_marker
 
     def add_metabolite(self, node: MetaboliteNode, coefficient: Union[float, int]):
         self.metabolites.append((coefficient, node))
         if self._map is not None:
             self._map.add_node(node)
 
-        ref_node = self.mid_marker
         plus_minus = coefficient > 0
-        if self.multi_markers[plus_minus] is not None:
-            ref_node = self.multi_markers[plus_minus]
-
+        ref_node = self._ref_node(plus_minus)
         if plus_minus:
             segment = Segment(ref_node, node)
         else:
@@ -264,29 +374,29 @@ class Reaction:
         self.add_segment(segment)
 
     def to_escher(self):
-        d = {
+        segment_to_escher = Segment.to_escher
+        gene_reaction_rule = self.gene_reaction_rule
+        genes = self.genes
+        return {
             "name": self.name,
             "bigg_id": self.bigg_id,
             "reversibility": self.reversibility,
             "label_x": self.label_x,
             "label_y": self.label_y,
-            "gene_reaction_rule": "",
-            "genes": [],
+            "gene_reaction_rule": "" if gene_reaction_rule is None else gene_reaction_rule,
+            "genes": [] if genes is None else genes,
             "metabolites": [
                 {"coefficient": coeff, "bigg_id": node.bigg_id}
                 for coeff, node in self.metabolites
             ],
             "segments": {
-                segment.identifier: segment.to_escher() for segment in self.segments
+                segment.identifier: segment_to_escher(segment)
+                for segment in self.segments
             },
         }
-        if self.gene_reaction_rule is not None:
-            d["gene_reaction_rule"] = self.gene_reaction_rule
-        if self.genes is not None:
-            d["genes"] = self.genes
-        return d
 
 
+@njit(cache=True, inline="always")
 def cubic_bezier_bt(t, b0, b1, b2, b3):
     bt = (
         ((1 - t) ** 3) * b0
@@ -297,6 +407,96 @@ def cubic_bezier_bt(t, b0, b1, b2, b3):
     return bt
 
 
+@njit(cache=True)
+def _place_kernel(
+    ref_x,
+    ref_y,
+    x,
+    y,
+    has_xy,
+    angle,
+    angle_delta,
+    plus_minus,
+    unit,
+    size,
+    b1_scale,
+    b2_scale,
+    b1_cos,
+    b1_sin,
+):
+    direction = angle + angle_delta + (1 - plus_minus) * pi
+    dir_cos = cos(direction)
+    dir_sin = sin(direction)
+    if has_xy:
+        dx = x - ref_x
+        dy = y - ref_y
+        dist2 = dx * dx + dy * dy
+        size = sqrt(dist2) / unit if dist2 > 0.0 else 0.0
+    else:
+        x = ref_x + unit * size * dir_cos
+        y = ref_y + unit * size * dir_sin
+
+    # The second handle points back along the placement direction.
+    b1_x = ref_x + unit * b1_scale * size * b1_cos
+    b1_y = ref_y + unit * b1_scale * size * b1_sin
+    b2_x = x - unit * (1 - b2_scale) * size * dir_cos
+    b2_y = y - unit * (1 - b2_scale) * size * dir_sin
+    return x, y, size, b1_x, b1_y, b2_x, b2_y
+
+
+@njit(cache=True)
+def _bezier_angle_kernel(ref_x, ref_y, b1_x, b1_y, b2_x, b2_y, x, y, size, angle, plus_minus):
+    # A node on top of its reference node has no length to sample along.
+    t = min(1.5 / size, 1.0) if size > 0.0 else 1.0
+    bt_x = cubic_bezier_bt(t, ref_x, b1_x, b2_x, x)
+    bt_y = cubic_bezier_bt(t, ref_y, b1_y, b2_y, y)
+    angle_delta = atan2(bt_y - ref_y, bt_x - ref_x) - angle
+    if not plus_minus:
+        angle_delta = angle_delta + pi
+    return angle_delta
+
+
+@njit(cache=True)
+def _auto_place_kernel(
+    ref_x,
+    ref_y,
+    x,
+    y,
+    has_xy,
+    angle,
+    angle_delta,
+    plus_minus,
+    unit,
+    size,
+    b1_scale,
+    b2_scale,
+    b1_cos,
+    b1_sin,
+):
+    # Placement with default bezier handles, fused into a single kernel call.
+    x, y, size, b1_x, b1_y, b2_x, b2_y = _place_kernel(
+        ref_x,
+        ref_y,
+        x,
+        y,
+        has_xy,
+        angle,
+        angle_delta,
+        plus_minus,
+        unit,
+        size,
+        b1_scale,
+        b2_scale,
+        b1_cos,
+        b1_sin,
+    )
+    angle_delta = _bezier_angle_kernel(
+        ref_x, ref_y, b1_x, b1_y, b2_x, b2_y, x, y, size, angle, plus_minus
+    )
+    return x, y, size, b1_x, b1_y, b2_x, b2_y, angle_delta
+
+
+@lru_cache(maxsize=128)
 def non_primary_scaling(x):
     return (1 - (min(x - 1, 5) / 5)) * 0.3 + 0.5
 
@@ -308,7 +508,7 @@ def default_text_offset(x):
 class PlacementOptions:
     def __init__(
         self,
-        delta=math.pi * 0.15,
+        delta=pi * 0.15,
         delta_tolerance=0.5,
         no_primary_length_f=None,
         scale=3.0,
@@ -337,6 +537,15 @@ class PlacementOptions:
 
 
 class AutoReaction(Reaction):
+    __slots__ = (
+        "angle",
+        "unit",
+        "_used_deltas",
+        "_ca",
+        "_sa",
+        "_uv",
+    )
+
     def __init__(
         self,
         bigg_id: str,
@@ -355,29 +564,30 @@ class AutoReaction(Reaction):
         text_offset = 16
 
         self._used_deltas = ([], [])
+        self._ca = cos(self.angle)
+        self._sa = sin(self.angle)
+        # Direction from a multi marker towards the metabolites, indexed by
+        # plus_minus.
+        self._uv = ((-self._ca, -self._sa), (self._ca, self._sa))
 
         if minus_multi_marker is None:
             minus_multi_marker = MultiMarkerNode(
-                mid_marker.x + self.unit * math.cos(self.angle + math.pi),
-                mid_marker.y + self.unit * math.sin(self.angle + math.pi),
+                mid_marker.x - self.unit * self._ca,
+                mid_marker.y - self.unit * self._sa,
             )
         if minus_multi_marker is mid_marker:
             minus_multi_marker = None
         if plus_multi_marker is None:
             plus_multi_marker = MultiMarkerNode(
-                mid_marker.x + self.unit * math.cos(self.angle),
-                mid_marker.y + self.unit * math.sin(self.angle),
+                mid_marker.x + self.unit * self._ca,
+                mid_marker.y + self.unit * self._sa,
             )
         if plus_multi_marker is mid_marker:
             plus_multi_marker = None
 
         if label_x is None or label_y is None:
-            label_x = mid_marker.x + text_offset * abs(math.cos(self.angle - 0.5 * math.pi))
-            label_y = (
-                mid_marker.y
-                + text_offset * math.sin(self.angle - 0.5 * math.pi)
-                + text_y_correction
-            )
+            label_x = mid_marker.x + text_offset * abs(self._sa)
+            label_y = mid_marker.y - text_offset * self._ca + text_y_correction
 
         super().__init__(
             bigg_id=bigg_id,
@@ -390,14 +600,15 @@ class AutoReaction(Reaction):
         )
 
     def alternating_side_placement(self, i, delta, plus_minus):
-        n = 1 + (i - 1) // 2
-        side = (i - 1) % 2
-        d = (n * delta) if side else -(n * delta)
+        # i = 0, 1, 2, 3, 4, ... gives d = 0, -delta, delta, -2 * delta, 2 * delta, ...
+        n = (i + 1) // 2
+        side = (i - 1) & 1
+        d = (2 * side - 1) * n * delta
         return n, side, d
 
     def same_side_placement(self, n, delta, plus_minus, absolute_side=0):
         side = bool(absolute_side) == bool(plus_minus)
-        if (self.angle % (2 * math.pi)) > math.pi:
+        if (self.angle % _TWO_PI) > pi:
             side = not side
         side = int(side)
 
@@ -408,63 +619,66 @@ class AutoReaction(Reaction):
         self, ref_node, node, plus_minus, angle_delta, n, b1_b2, placement_opts
     ):
         size = placement_opts.scale
-        angle = self.angle + angle_delta
-
-        x, y = node.x, node.y
-        if x is None or y is None:
-            if not node.node_is_primary:
-                size = placement_opts.no_primary_length_f(n) * placement_opts.scale
-            x = ref_node.x + self.unit * size * math.cos(
-                angle + (1 - plus_minus) * math.pi
-            )
-            y = ref_node.y + self.unit * size * math.sin(
-                angle + (1 - plus_minus) * math.pi
+        has_xy = node.x is not None and node.y is not None
+        if not has_xy and not node.node_is_primary:
+            size = placement_opts.no_primary_length_f(n) * placement_opts.scale
+        b1_cos, b1_sin = self._uv[plus_minus]
+
+        ref_x = float(ref_node.x)
+        ref_y = float(ref_node.y)
+        angle = float(self.angle)
+        placement_args = (
+            ref_x,
+            ref_y,
+            float(node.x) if has_xy else 0.0,
+            float(node.y) if has_xy else 0.0,
+            has_xy,
+            angle,
+            float(angle_delta),
+            int(plus_minus),
+            float(self.unit),
+            float(size),
+            float(placement_opts.b1_scale),
+            float(placement_opts.b2_scale),
+            b1_cos,
+            b1_sin,
+        )
+
+        if b1_b2 is None:
+            x, y, size, b1_x, b1_y, b2_x, b2_y, effective_angle_delta = _auto_place_kernel(
+                *placement_args
             )
+            b1 = (b1_x, b1_y)
+            b2 = (b2_x, b2_y)
         else:
-            size = math.sqrt((x - ref_node.x) ** 2 + (y - ref_node.y) ** 2) / self.unit
-
-        if b1_b2 is not None:
+            x, y, size, _, _, _, _ = _place_kernel(*placement_args)
             b1, b2 = b1_b2
-        else:
-            b2 = (
-                x
-                + self.unit
-                * (1 - placement_opts.b2_scale)
-                * size
-                * math.cos(angle + (2 - plus_minus) * math.pi),
-                y
-                + self.unit
-                * (1 - placement_opts.b2_scale)
-                * size
-                * math.sin(angle + (2 - plus_minus) * math.pi),
-            )
-            # b2 = None
-            b1 = (
-                ref_node.x
-                + self.unit
-                * placement_opts.b1_scale
-                * size
-                * math.cos(self.angle + (1 - plus_minus) * math.pi),
-                ref_node.y
-                + self.unit
-                * placement_opts.b1_scale
-                * size
-                * math.sin(self.angle + (1 - plus_minus) * math.pi),
+            effective_angle_delta = _bezier_angle_kernel(
+                ref_x,
+                ref_y,
+                float(b1[0]) if b1 is not None else ref_x,
+                float(b1[1]) if b1 is not None else ref_y,
+                float(b2[0]) if b2 is not None else x,
+                float(b2[1]) if b2 is not None else y,
+                x,
+                y,
+                size,
+                angle,
+                int(plus_minus),
             )
-        t = min(1.5 / size, 1.0)
-        bt = (
-            cubic_bezier_bt(t, ref_node.x, b1[0] if b1 is not None else ref_node.x, b2[0] if b2 is not None else x, x),
-            cubic_bezier_bt(t, ref_node.y, b1[1] if b1 is not None else ref_node.y, b2[1] if b2 is not None else y, y),
-        )
-        effective_angle_delta = (
-            math.atan2(bt[1] - ref_node.y, bt[0] - ref_node.x) - self.angle
-        )
-        if not plus_minus:
-            effective_angle_delta = effective_angle_delta + math.pi
-        effective_angle_delta = math.remainder(effective_angle_delta, math.pi * 2)
+        effective_angle_delta = remainder(effective_angle_delta, _TWO_PI)
 
         return x, y, size, b1, b2, effective_angle_delta
 
+    def _delta_in_use(self, plus_minus, angle_delta, tolerance):
+        # The used deltas are kept sorted, so only the direct neighbours of
+        # angle_delta have to be checked.
+        used_deltas = self._used_deltas[plus_minus]
+        i = bisect_left(used_deltas, angle_delta)
+        if i < len(used_deltas) and used_deltas[i] - angle_delta < tolerance:
+            return True
+        return i > 0 and angle_delta - used_deltas[i - 1] < tolerance
+
     def add_metabolite(
         self,
         node: MetaboliteNode,
@@ -476,61 +690,40 @@ class AutoReaction(Reaction):
             placement_opts = PlacementOptions()
         if placement_opts.placement_f is None:
             placement_opts.placement_f = self.__class__.alternating_side_placement
-        ref_node = self.mid_marker
         plus_minus = coefficient > 0
-        if self.multi_markers[plus_minus] is not None:
-            ref_node = self.multi_markers[plus_minus]
+        ref_node = self._ref_node(plus_minus)
 
         if node.x is not None and node.y is not None and b1_b2 is not None:
             x, y, size, b1, b2, effective_angle_delta = self.calculate_placement(
                 ref_node, node, plus_minus, 0, 0, b1_b2, placement_opts
             )
             side = effective_angle_delta >= 0
-            n = abs(effective_angle_delta) / placement_opts.delta
         else:
+            placement_f = placement_opts.placement_f
+            delta = placement_opts.delta
+            tolerance = placement_opts.delta_tolerance * delta
             for i in range(10):
-                n, side, angle_delta = placement_opts.placement_f(
-                    self, i, placement_opts.delta, plus_minus
-                )
+                n, side, angle_delta = placement_f(self, i, delta, plus_minus)
                 x, y, size, b1, b2, effective_angle_delta = self.calculate_placement(
                     ref_node, node, plus_minus, angle_delta, n, b1_b2, placement_opts
                 )
                 # print(f"{node.bigg_id}: ({i}): (n:{n}, side:{side}, angle_delta:{angle_delta}) -> (x:{x}, y:{y}, size:{size}, b1:{b1}, b2:{b2}, effective_angle_delta:{effective_angle_delta})")
-                if not any(
-                    abs(d - effective_angle_delta) < (placement_opts.delta_tolerance * placement_opts.delta)
-                    for d in self._used_deltas[plus_minus]
-                ):
+                if not self._delta_in_use(plus_minus, effective_angle_delta, tolerance):
                     break
 
-        self._used_deltas[plus_minus].append(effective_angle_delta)
+        insort(self._used_deltas[plus_minus], effective_angle_delta)
         node.x = x
         node.y = y
 
         if node.label_x is None or node.label_y is None:
-            x_positive = -min(
-                0,
-                math.cos(
-                    self.angle
-                    + (1 if bool(side) == bool(plus_minus) else -1) * 0.5 * math.pi
-                ),
-            )
-            label_x = node.x + placement_opts.text_offset_f(
-                x_positive * len(node.bigg_id)
-            ) * math.cos(
-                self.angle
-                + (1 if bool(side) == bool(plus_minus) else -1) * 0.5 * math.pi
-            )
-            label_y = (
-                node.y
-                + placement_opts.text_offset_f(x_positive * len(node.bigg_id))
-                * math.sin(
-                    self.angle
-                    + (1 if bool(side) == bool(plus_minus) else -1) * 0.5 * math.pi
-                )
-                + placement_opts.text_y_correction
-            )
-            node.label_x = label_x
-            node.label_y = label_y
+            # cos/sin of self.angle +/- 0.5 * pi, depending on the side.
+            sign = 1.0 if bool(side) == bool(plus_minus) else -1.0
+            label_cos = -sign * self._sa
+            label_sin = sign * self._ca
+            x_positive = -min(0, label_cos)
+            text_offset = placement_opts.text_offset_f(x_positive * len(node.bigg_id))
+            node.label_x = node.x + text_offset * label_cos
+            node.label_y = node.y + text_offset * label_sin + placement_opts.text_y_correction
 
         self.metabolites.append((coefficient, node))
         if self._map is not None:
@@ -543,6 +736,8 @@ class AutoReaction(Reaction):
         self.add_segment(segment)
 
 class AutoReactionWithOptionalMetabolites(AutoReaction):
+    __slots__ = ("optional_metabolites", "finalized")
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.optional_metabolites = {}
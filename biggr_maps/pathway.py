@@ -1,6 +1,6 @@
 from typing import Any, Dict, List, Optional, Tuple
 from biggr_maps.map import Map, AutoReaction, MetaboliteNode, MidMarkerNode, Node
-import math
+from math import atan2, sqrt
 
 
 def alternating_pathways_sides(
@@ -13,22 +13,24 @@ def alternating_pathways_sides(
 ):
     dx = node2.x - node1.x
     dy = node2.y - node1.y
-    distance = math.sqrt(dx**2 + dy**2)
+    distance = sqrt(dx * dx + dy * dy)
     center_point = (node1.x + dx/2, node1.y + dy/2)
     normal = (-dy/distance, dx/distance)
 
+    threshold2 = (spacing * 0.99) ** 2
     i = 1 if centered else 0
     while True:
         side = i%2
         f = (i//2)
         if not centered:
             f += 0.5
-        mid_marker_xy = (
-            center_point[0] + (1 if side else -1) * f * spacing * normal[0],
-            center_point[1] + (1 if side else -1) * f * spacing * normal[1],
-        )
-        if not any(math.sqrt((mid_marker_xy[0] - node.x)**2 + (mid_marker_xy[1] - node.y)**2) < spacing*0.99 for node in mid_markers):
-            return mid_marker_xy
+        x = center_point[0] + (1 if side else -1) * f * spacing * normal[0]
+        y = center_point[1] + (1 if side else -1) * f * spacing * normal[1]
+        if not any(
+            (x - node.x) * (x - node.x) + (y - node.y) * (y - node.y) < threshold2
+            for node in mid_markers
+        ):
+            return x, y
         i += 1
 
 def place_reaction_on_backbone(
@@ -44,13 +46,15 @@ def place_reaction_on_backbone(
     if add_metabolite_opts is None:
         add_metabolite_opts = {}
     backbone_nodes = [
-        (coeff, n) for coeff, n in reaction_info if n.identifier in map.nodes
+        (coeff, n) for coeff, n in reaction_info if map.has_node(n)
     ]
-    while len(backbone_nodes) > 1:
-        if (backbone_nodes[0][0] > 0) == (backbone_nodes[1][0] > 0):
-            backbone_nodes.pop(1)
-        else:
-            break
+    if backbone_nodes:
+        # Pair the first backbone node with the first one on the other side.
+        it = iter(backbone_nodes)
+        first = next(it)
+        first_sign = first[0] > 0
+        second = next((x for x in it if (x[0] > 0) != first_sign), None)
+        backbone_nodes = [first] if second is None else [first, second]
     if len(backbone_nodes) < 2:
         raise ValueError(
             f"Two metabolite nodes should be present in the map already, found {len(backbone_nodes)}."
@@ -66,12 +70,12 @@ def place_reaction_on_backbone(
         plus_node = backbone_nodes[1][1]
         minus_node = backbone_nodes[0][1]
 
-    angle = math.atan2(plus_node.y - minus_node.y, plus_node.x - minus_node.x)
+    angle = atan2(plus_node.y - minus_node.y, plus_node.x - minus_node.x)
     # mid_marker = MidMarkerNode(
     #     plus_node.x + (minus_node.x - plus_node.x) / 2,
     #     plus_node.y + (minus_node.y - plus_node.y) / 2,
     # )
-    mid_markers = [node for node in map.nodes.values() if node.node_type == "midmarker"]
+    mid_markers = list(map.mid_markers)
     if additional_mid_markers is not None:
         mid_markers.extend(additional_mid_markers)
     mid_marker = MidMarkerNode(*placement_f(map, plus_node, minus_node, mid_markers))
@@ -1,11 +1,11 @@
-import json
 import math
 from typing import TextIO
+import orjson
 from biggr_maps import map
 
 
 def load_as_template(fp: TextIO) -> map.Map:
-    data = json.load(fp)
+    data = orjson.loads(fp.read())
     m = map.Map(
         name=data[0]["map_name"],
         description=data[0]["map_description"],
@@ -28,31 +28,29 @@ def load_as_template(fp: TextIO) -> map.Map:
         mid_marker = None
         plus_multi_marker = None
         minus_multi_marker = None
+        # The first entry wins when a metabolite is listed more than once.
+        coef_by_id = {}
+        for x in reaction_data["metabolites"]:
+            coef_by_id.setdefault(x["bigg_id"], x["coefficient"])
         for segment_id, segment in reaction_data.get("segments", {}).items():
-            for k in ["from_node_id", "to_node_id"]:
-                node = nodes[segment[k]]
+            from_node = nodes[segment["from_node_id"]]
+            to_node = nodes[segment["to_node_id"]]
+            b1 = segment.get("b1")
+            b2 = segment.get("b2")
+            if b1 is not None:
+                b1 = (b1["x"], b1["y"])
+            if b2 is not None:
+                b2 = (b2["x"], b2["y"])
+            # The bezier handles are stored relative to the metabolite, so
+            # they are swapped when the metabolite is the start of the segment.
+            for node, other_node, b1_b2 in (
+                (from_node, to_node, (b2, b1)),
+                (to_node, from_node, (b1, b2)),
+            ):
                 if node.node_type == "metabolite":
-                    if k == "from_node_id":
-                        b1 = segment.get("b2")
-                        b2 = segment.get("b1")
-                    else:
-                        b1 = segment.get("b1")
-                        b2 = segment.get("b2")
-                    if b1 is not None:
-                        b1 = (b1["x"], b1["y"])
-                    if b2 is not None:
-                        b2 = (b2["x"], b2["y"])
-                    associated_metabolites[node.bigg_id] = (node, (b1, b2))
+                    associated_metabolites[node.bigg_id] = (node, b1_b2)
                     if node.node_is_primary:
-                        if k == "from_node_id":
-                            other_node = nodes[segment["to_node_id"]]
-                        else:
-                            other_node = nodes[segment["from_node_id"]]
-                        coefficient = next(
-                            x["coefficient"]
-                            for x in reaction_data["metabolites"]
-                            if x["bigg_id"] == node.bigg_id
-                        )
+                        coefficient = coef_by_id[node.bigg_id]
                         angle = math.atan2(node.y - other_node.y, node.x - other_node.x)
                         if coefficient < 0:
                             angle = math.remainder(angle + math.pi, 2 * math.pi)
@@ -26,5 +26,10 @@ setup(
     ],
     install_requires=[
         "escher",
+        "numpy",
+        "orjson",
     ],
+    extras_require={
+        "jit": ["numba"],
+    },
 )
\ No newline at end of file